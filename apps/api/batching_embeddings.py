@@ -0,0 +1,50 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+
+class BatchingEmbeddings(Embeddings):
+    # Coalesces concurrent embed_query calls into one encoder batch. Retrievals run in
+    # executor threads under chain.ainvoke, so each caller blocks on a Future while a
+    # single worker thread drains the queue for up to window_ms or max_batch queries.
+    # Queries go through embed_documents, which matches embed_query for MiniLM.
+
+    def __init__(self, inner: Embeddings, window_ms: float = 10.0, max_batch: int = 32):
+        self.inner = inner
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        threading.Thread(target=self._run, name="embed-batcher", daemon=True).start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                vectors = self.inner.embed_documents([text for text, _ in batch])
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future.result()
@@ -0,0 +1,36 @@
+import threading
+from collections import OrderedDict
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from hashing import hash128
+
+
+class CachedQueryEmbeddings(Embeddings):
+    # The summarizer uses the whole report as its retrieval query, and the same report
+    # (or chat question) is often retried or sent to both the JSON and stream
+    # endpoints. Keep the most recent query vectors, keyed by a hash of the text.
+
+    def __init__(self, inner: Embeddings, max_size: int = 256):
+        self.inner = inner
+        self.max_size = max_size
+        self._cache: "OrderedDict[bytes, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = hash128(text.encode("utf-8")).digest()
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                return vector
+        vector = self.inner.embed_query(text)
+        with self._lock:
+            self._cache[key] = vector
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return vector
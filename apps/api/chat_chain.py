@@ -1,10 +1,9 @@
-import os
-
-from langchain_community.chat_models import ChatOllama
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableLambda
 
+from llm import get_llm
+
 CHAT_SYSTEM = (
     "You are a careful clinical information assistant. "
     "The patient report is your primary source. Use KB context only as secondary support. "
@@ -28,19 +27,15 @@ Instructions:
 """
 
 
-def make_chat_chain(retriever=None, format_docs_fn=None):
-    llm = ChatOllama(
-        model=os.getenv("OLLAMA_MODEL", "llama3.2"),
-        temperature=0.0,
-    )
+CHAT_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", CHAT_SYSTEM),
+        ("human", CHAT_HUMAN),
+    ]
+)
 
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", CHAT_SYSTEM),
-            ("human", CHAT_HUMAN),
-        ]
-    )
 
+def make_chat_chain(retriever=None, format_docs_fn=None):
     def retrieve_kb(inputs: dict) -> str:
         if retriever is None or format_docs_fn is None:
             return "[KB:empty]\n(No relevant knowledge found.)"
@@ -58,8 +53,8 @@ def make_chat_chain(retriever=None, format_docs_fn=None):
             "report": lambda x: (x.get("report") or ""),
             "kb": kb_runnable,
         }
-        | prompt
-        | llm
+        | CHAT_PROMPT
+        | get_llm()
         | StrOutputParser()
     )
 
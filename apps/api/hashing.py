@@ -0,0 +1,13 @@
+import hashlib
+from functools import partial
+
+# Non-cryptographic hashes for cache keys and fingerprints. xxhash is much faster,
+# but nothing depends on the exact digest, so fall back to stdlib blake2b.
+try:
+    import xxhash
+
+    hash64 = xxhash.xxh3_64
+    hash128 = xxhash.xxh3_128
+except ImportError:
+    hash64 = partial(hashlib.blake2b, digest_size=8)
+    hash128 = partial(hashlib.blake2b, digest_size=16)
@@ -1,32 +1,143 @@
 import glob
+import json
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
 
 import pandas as pd
 from langchain_community.docstore.document import Document
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 
+from hashing import hash64
 
-def load_kb_docs(kb_glob_pattern: str = "sample_kb/*"):
-    docs = []
-    for path in glob.glob(kb_glob_pattern):
-        try:
-            base = os.path.basename(path)
-            lower = path.lower()
-            if lower.endswith(".pdf"):
-                loaded = PyPDFLoader(path).load()
-                for doc in loaded:
-                    doc.metadata["source"] = base
-                docs.extend(loaded)
-            elif lower.endswith(".csv"):
-                df = pd.read_csv(path)
-                for _, row in df.iterrows():
-                    text = "\n".join(f"{col}: {row[col]}" for col in df.columns)
-                    docs.append(Document(page_content=text, metadata={"source": base}))
-            else:
-                loaded = TextLoader(path, encoding="utf-8").load()
-                for doc in loaded:
-                    doc.metadata["source"] = base
-                docs.extend(loaded)
-        except Exception as exc:
-            print(f"[KB loader] Failed to load {path}: {exc}")
-    return docs
+try:
+    # PyMuPDF's C text extractor is several times faster than pure-Python pypdf.
+    import fitz  # noqa: F401
+    from langchain_community.document_loaders import PyMuPDFLoader as PDFLoader
+except ImportError:
+    PDFLoader = PyPDFLoader
+
+# Bump when the Document text a loader produces changes (e.g. the CSV row format), so
+# cached parses and persisted indexes built from the old text are not reused.
+LOADER_VERSION = 2
+# The PDF backend also changes extracted text, so both go into the parse-cache key and
+# the persisted index meta.
+LOADER_ID = f"v{LOADER_VERSION}+{PDFLoader.__name__}"
+
+# Spawned workers re-import pandas and langchain (a second or more each) before
+# parsing anything, so only use processes for a batch of uncached PDFs large enough
+# to amortize that.
+PROCESS_POOL_MIN_PDFS = 16
+
+
+def _load_one(path: str):
+    try:
+        base = os.path.basename(path)
+        lower = path.lower()
+        if lower.endswith(".pdf"):
+            loaded = PDFLoader(path).load()
+            for doc in loaded:
+                doc.metadata["source"] = base
+            return loaded
+        if lower.endswith(".csv"):
+            # Read cells as text (blank cells stay blank) and build every row's
+            # "col: value" lines with column-wise string ops instead of a Python loop.
+            df = pd.read_csv(path, dtype=str, keep_default_na=False)
+            if df.empty:
+                return []
+            texts = f"{df.columns[0]}: " + df.iloc[:, 0]
+            for pos in range(1, df.shape[1]):
+                texts = texts.str.cat(f"{df.columns[pos]}: " + df.iloc[:, pos], sep="\n")
+            return [Document(page_content=text, metadata={"source": base}) for text in texts.tolist()]
+        loaded = TextLoader(path, encoding="utf-8").load()
+        for doc in loaded:
+            doc.metadata["source"] = base
+        return loaded
+    except Exception as exc:
+        print(f"[KB loader] Failed to load {path}: {exc}")
+        return []
+
+
+def _cache_key(path: str) -> str:
+    stat = os.stat(path)
+    payload = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{LOADER_ID}"
+    return hash64(payload.encode("utf-8")).hexdigest()
+
+
+def _cache_file(path: str, cache_dir: str) -> Optional[str]:
+    try:
+        return os.path.join(cache_dir, f"{_cache_key(path)}.json")
+    except OSError:
+        return None
+
+
+def _read_cache(cache_file: str):
+    try:
+        with open(cache_file, encoding="utf-8") as handle:
+            records = json.load(handle)
+        return [Document(page_content=r["page_content"], metadata=r["metadata"]) for r in records]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_cache(cache_file: str, path: str, loaded):
+    try:
+        records = [{"page_content": d.page_content, "metadata": d.metadata} for d in loaded]
+        with open(cache_file, "w", encoding="utf-8") as handle:
+            json.dump(records, handle, default=str)
+    except OSError as exc:
+        print(f"[KB loader] Could not cache {path}: {exc}")
+
+
+def _prune_cache(cache_dir: str, keep):
+    for name in os.listdir(cache_dir):
+        if name.endswith(".json") and name not in keep:
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
+
+
+def _make_pool(paths):
+    # pypdf is pure Python and holds the GIL, so several PDFs are parsed in worker
+    # processes; otherwise threads avoid the process start-up cost.
+    workers = min(os.cpu_count() or 1, len(paths))
+    pdfs = sum(path.lower().endswith(".pdf") for path in paths)
+    if pdfs >= PROCESS_POOL_MIN_PDFS and workers > 1:
+        # The server is multi-threaded by the time the KB loads (event loop, torch,
+        # the embedding batcher), and forking a threaded process can deadlock.
+        return ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+    return ThreadPoolExecutor(max_workers=min(8, workers))
+
+
+def load_kb_docs(kb_glob_pattern: str = "sample_kb/*", cache_dir: Optional[str] = None):
+    paths = glob.glob(kb_glob_pattern)
+    if not paths:
+        return []
+
+    # Parsed documents are kept as JSON per file, keyed by path/size/mtime, so
+    # unchanged files are not re-parsed on every rebuild.
+    results = [None] * len(paths)
+    cache_files = [None] * len(paths)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        for i, path in enumerate(paths):
+            cache_files[i] = _cache_file(path, cache_dir)
+            if cache_files[i]:
+                results[i] = _read_cache(cache_files[i])
+
+    misses = [i for i, loaded in enumerate(results) if loaded is None]
+    if misses:
+        miss_paths = [paths[i] for i in misses]
+        with _make_pool(miss_paths) as ex:
+            for i, loaded in zip(misses, ex.map(_load_one, miss_paths)):
+                results[i] = loaded
+                if loaded and cache_files[i]:
+                    _write_cache(cache_files[i], paths[i], loaded)
+
+    if cache_dir:
+        _prune_cache(cache_dir, {os.path.basename(f) for f in cache_files if f})
+    return [doc for loaded in results for doc in loaded]
@@ -0,0 +1,22 @@
+import os
+from functools import lru_cache
+
+from langchain_community.chat_models import ChatOllama
+
+
+@lru_cache(maxsize=1)
+def get_llm() -> ChatOllama:
+    # Shared by the summarizer and chat chains; built once per process.
+    return ChatOllama(
+        # Explicit tag for what llama3.2:latest currently resolves to, so the default
+        # model stays reproducible if latest is re-pointed.
+        model=os.getenv("OLLAMA_MODEL", "llama3.2:3b-instruct-q4_K_M"),
+        temperature=0.0,
+        # Keep weights resident between requests instead of Ollama's 5 minute default.
+        keep_alive=os.getenv("OLLAMA_KEEP_ALIVE", "30m"),
+        # Fixed context size for every call (including the startup warmup) so Ollama
+        # never reloads the model to resize its KV cache; report + KB fits in 4096.
+        num_ctx=int(os.getenv("OLLAMA_NUM_CTX", "4096")),
+        # Upper bound on generated tokens so a runaway decode cannot hold a slot.
+        num_predict=int(os.getenv("OLLAMA_NUM_PREDICT", "1024")),
+    )
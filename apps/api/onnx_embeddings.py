@@ -0,0 +1,70 @@
+import os
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class OnnxEmbeddings(Embeddings):
+    # Mean-pooled, L2-normalized sentence embeddings from an ONNX export of a
+    # sentence-transformers model (e.g. an INT8-quantized all-MiniLM-L6-v2).
+
+    def __init__(
+        self,
+        model_dir: str,
+        tokenizer_name: str,
+        file_name: str = "model_quantized.onnx",
+        batch_size: int = 64,
+        num_threads: int = 0,
+        max_length: int = 256,
+    ):
+        # Lazy imports keep onnxruntime optional for the default embedding path.
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or os.cpu_count() or 0
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, file_name),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {entry.name for entry in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+        self.batch_size = batch_size
+        # sentence-transformers truncates MiniLM at max_seq_length=256, not the
+        # tokenizer's 512, so match it to produce the same vectors.
+        self.max_length = max_length
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        encoded = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        feeds = {
+            name: value.astype(np.int64)
+            for name, value in encoded.items()
+            if name in self.input_names
+        }
+        hidden = self.session.run(None, feeds)[0]
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Encode in length-sorted batches so each batch pads to similar lengths,
+        # then restore the caller's order (same trick SentenceTransformer.encode uses).
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        vectors: List[List[float]] = [[] for _ in texts]
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            for idx, vec in zip(batch, self._encode([texts[i] for i in batch]).tolist()):
+                vectors[idx] = vec
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
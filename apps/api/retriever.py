@@ -1,42 +1,367 @@
 import glob
-import hashlib
 import json
+import multiprocessing
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from typing import List, Optional
 
+import faiss
+import numpy as np
 from langchain_community.docstore.document import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from hashing import hash64, hash128
+from kb_loader import LOADER_ID
+
 DEFAULT_EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_INDEX_TYPE = "hnsw"
+DEFAULT_SEARCH_TYPE = "mmr"
+# Embeddings are L2-normalized, so inner product ranks exactly like cosine similarity.
+INDEX_METRIC = "ip"
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+IVF_MIN_VECTORS = 2000
+# FAISS k-means wants at least this many training points per centroid; fewer leaves
+# the inverted-list centroids under-trained (and logs a clustering warning).
+IVF_MIN_POINTS_PER_LIST = 39
+# IVF-PQ needs enough vectors to train its coarse and PQ codebooks; smaller KBs use HNSW.
+IVFPQ_MIN_VECTORS = 10000
+IVFPQ_SUBQUANTIZERS = 16
+# Chunk sizes are measured in embedding-model tokens (MiniLM's window is 256).
+DEFAULT_CHUNK_SIZE = 200
+DEFAULT_CHUNK_OVERLAP = 20
+SPLIT_SEPARATORS = ["\n\n", "\n", ". ", " ", ""]
+INDEX_FILE = "faiss.index"
+DOCS_FILE = "docs.json"
+EMBED_CACHE_VECTORS = "vecs.npy"
+EMBED_CACHE_KEYS = "chunk_hashes.json"
+# Spawned split workers re-import faiss and langchain and load the tokenizer; below
+# this much KB text that start-up costs more than parallel splitting saves.
+SPLIT_POOL_MIN_CHARS = 2_000_000
+
+
+def _embed_onnx_dir() -> str:
+    return os.getenv("EMBED_ONNX_DIR", "")
+
+
+def _make_encoder(model_name: str):
+    batch_size = int(os.getenv("EMBED_BATCH_SIZE", "128"))
+    # 0 keeps the runtime default; containers often report more CPUs than their quota.
+    num_threads = int(os.getenv("EMBED_NUM_THREADS", "0"))
+    onnx_dir = _embed_onnx_dir()
+    if onnx_dir:
+        from onnx_embeddings import OnnxEmbeddings
+
+        return OnnxEmbeddings(
+            onnx_dir,
+            tokenizer_name=model_name,
+            batch_size=batch_size,
+            num_threads=num_threads,
+        )
+    import torch
+
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    device = os.getenv("EMBED_DEVICE", "auto")
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    model_kwargs = {"device": device}
+    if device.startswith("cuda"):
+        # Half-precision weights halve memory traffic through the encoder on GPU.
+        model_kwargs["model_kwargs"] = {"dtype": torch.float16}
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs=model_kwargs,
+        encode_kwargs={"batch_size": batch_size, "normalize_embeddings": True},
+    )
+
+
+@lru_cache(maxsize=2)
+def _make_embeddings(model_name: str):
+    # One encoder per model per process, shared by index builds, loads and queries.
+    encoder = _make_encoder(model_name)
+    window_ms = float(os.getenv("EMBED_BATCH_WINDOW_MS", "0"))
+    if window_ms > 0:
+        from batching_embeddings import BatchingEmbeddings
+
+        encoder = BatchingEmbeddings(encoder, window_ms=window_ms)
+    cache_size = int(os.getenv("EMBED_QUERY_CACHE_SIZE", "256"))
+    if cache_size > 0:
+        from cached_embeddings import CachedQueryEmbeddings
+
+        encoder = CachedQueryEmbeddings(encoder, max_size=cache_size)
+    return encoder
+
+
+def _embedding_id(model_name: str) -> str:
+    # Recorded in meta.json so an index built by one backend is not reused by another.
+    onnx_dir = _embed_onnx_dir()
+    return f"{model_name}+onnx:{onnx_dir}" if onnx_dir else model_name
+
+
+def _build_faiss_index(vectors: np.ndarray, index_type: str):
+    dim = vectors.shape[1]
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.add(vectors)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+        index.add(vectors)
+        return index
+    if index_type == "sq8":
+        # 8-bit scalar quantization: 4x smaller than float32 and the scan stays exact
+        # over the quantized codes; normalized MiniLM vectors lose very little recall.
+        index = faiss.IndexScalarQuantizer(
+            dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(vectors)
+        index.add(vectors)
+        return index
+    if index_type == "ivf":
+        if len(vectors) < IVF_MIN_VECTORS:
+            return _build_faiss_index(vectors, "hnsw")
+        # Exact vectors in ~4*sqrt(N) inverted lists; each query scans nprobe of them.
+        nlist = _ivf_nlist(len(vectors))
+        index = faiss.index_factory(dim, f"IVF{nlist},Flat", faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add(vectors)
+        _tune_ivf(index)
+        return index
+    if index_type == "ivfpq":
+        if len(vectors) < IVFPQ_MIN_VECTORS or dim % IVFPQ_SUBQUANTIZERS:
+            return _build_faiss_index(vectors, "hnsw")
+        # Inverted lists over PQ codes: ~16x smaller than float32 and only nprobe lists
+        # are scanned per query.
+        nlist = _ivf_nlist(len(vectors))
+        index = faiss.index_factory(
+            dim, f"IVF{nlist},PQ{IVFPQ_SUBQUANTIZERS}x8", faiss.METRIC_INNER_PRODUCT
+        )
+        # The factory turns on polysemous training, which dominates train time and is
+        # only used when polysemous_ht is set for search; it never is here.
+        index.do_polysemous_training = False
+        index.train(vectors)
+        index.add(vectors)
+        _tune_ivf(index)
+        return index
+    raise ValueError(f"Unsupported FAISS index type: {index_type}")
+
+
+def _ivf_nlist(n: int) -> int:
+    return max(1, min(4096, int(4 * np.sqrt(n)), n // IVF_MIN_POINTS_PER_LIST))
+
+
+def _tune_ivf(index):
+    index.nprobe = IVF_NPROBE
+    # LangChain's MMR search reconstructs fetched vectors by id, which IVF only
+    # supports with a direct map.
+    index.make_direct_map()
+
+
+def _tune_loaded_index(index):
+    # Search-time parameters are reapplied after loading from disk.
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    if isinstance(index, faiss.IndexIVF):
+        _tune_ivf(index)
+
+
+@lru_cache(maxsize=4)
+def _get_tokenizer(model_name: str):
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(model_name)
+
+
+@lru_cache(maxsize=4)
+def _get_splitter(model_name: str, chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        _get_tokenizer(model_name),
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=SPLIT_SEPARATORS,
+    )
+
+
+def _split_worker(args) -> List[Document]:
+    # The HF length function is a closure and does not pickle, so each worker process
+    # builds (and caches) its own splitter from the model name.
+    model_name, chunk_size, chunk_overlap, docs = args
+    return _get_splitter(model_name, chunk_size, chunk_overlap).split_documents(docs)
+
+
+def _split_docs(docs: List[Document], model_name: str, chunk_size: int, chunk_overlap: int) -> List[Document]:
+    # Token-length splitting is pure Python and GIL-bound; large KBs are split per
+    # document across processes. Output order matches a sequential split.
+    workers = min(os.cpu_count() or 1, len(docs))
+    if workers < 2 or sum(len(doc.page_content) for doc in docs) < SPLIT_POOL_MIN_CHARS:
+        return _get_splitter(model_name, chunk_size, chunk_overlap).split_documents(docs)
+    jobs = [(model_name, chunk_size, chunk_overlap, [doc]) for doc in docs]
+    # Spawn rather than fork: the caller runs in a thread of a multi-threaded server.
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as ex:
+        parts = ex.map(_split_worker, jobs, chunksize=max(1, len(jobs) // (workers * 4)))
+        return [chunk for part in parts for chunk in part]
+
+
+def _coalesce_chunks(
+    chunks: List[Document],
+    splitter: RecursiveCharacterTextSplitter,
+    token_len,
+    target: int,
+) -> List[Document]:
+    # Split-then-merge: fold fragments under target/4 tokens into a neighbour from the
+    # same source while the result stays within 5% of target, then re-split anything
+    # still oversized so headers and footers do not become lone chunks.
+    min_size = target // 4
+    ceiling = int(target * 1.05)
+    merged: List[Document] = []
+    sizes: List[int] = []
+    for chunk in chunks:
+        size = token_len(chunk.page_content)
+        if merged:
+            prev = merged[-1]
+            same_source = prev.metadata.get("source") == chunk.metadata.get("source")
+            small = size < min_size or sizes[-1] < min_size
+            if same_source and small and sizes[-1] + size <= ceiling:
+                metadata = dict(prev.metadata)
+                if metadata.get("page") != chunk.metadata.get("page"):
+                    metadata.pop("page", None)
+                merged[-1] = Document(
+                    page_content=f"{prev.page_content}\n{chunk.page_content}",
+                    metadata=metadata,
+                )
+                sizes[-1] += size
+                continue
+        merged.append(chunk)
+        sizes.append(size)
+
+    result: List[Document] = []
+    for chunk, size in zip(merged, sizes):
+        if size > ceiling:
+            result.extend(splitter.split_documents([chunk]))
+        else:
+            result.append(chunk)
+    return result
+
+
+def _chunk_key(text: str, embedding_id: str) -> str:
+    return hash64(f"{embedding_id}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _read_json(path: str):
+    with open(path, encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def _load_embedding_cache(cache_dir: str) -> dict:
+    try:
+        vectors = np.load(os.path.join(cache_dir, EMBED_CACHE_VECTORS))
+        keys = _read_json(os.path.join(cache_dir, EMBED_CACHE_KEYS))
+    except (OSError, ValueError):
+        return {}
+    if len(keys) != len(vectors):
+        return {}
+    return dict(zip(keys, vectors))
+
+
+def _save_embedding_cache(cache_dir: str, keys: List[str], vectors: np.ndarray):
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(os.path.join(cache_dir, EMBED_CACHE_VECTORS), vectors)
+    with open(os.path.join(cache_dir, EMBED_CACHE_KEYS), "w", encoding="utf-8") as handle:
+        json.dump(keys, handle)
+
+
+def _embed_chunks(emb, texts: List[str], embedding_id: str, cache_dir: Optional[str]) -> np.ndarray:
+    # Reuse vectors for chunks whose text was embedded by the same model in a previous
+    # build; only new or edited chunks go through the encoder. Misses are embedded in
+    # one call so the encoder can batch internally.
+    keys = [_chunk_key(text, embedding_id) for text in texts]
+    cached = _load_embedding_cache(cache_dir) if cache_dir else {}
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    if missing:
+        fresh = np.asarray(emb.embed_documents([texts[i] for i in missing]), dtype=np.float32)
+        dim = fresh.shape[1]
+    else:
+        dim = len(next(iter(cached.values())))
+
+    vectors = np.empty((len(texts), dim), dtype=np.float32)
+    for i, key in enumerate(keys):
+        if key in cached:
+            vectors[i] = cached[key]
+    if missing:
+        vectors[missing] = fresh
+    # Also covers vectors cached before embeddings were normalized at encode time.
+    faiss.normalize_L2(vectors)
+
+    if cache_dir:
+        _save_embedding_cache(cache_dir, keys, vectors)
+    return vectors
+
+
+def _make_faiss_store(emb, index, chunks: List[Document]) -> FAISS:
+    # Row i of the FAISS index maps to docstore id str(i).
+    return FAISS(
+        embedding_function=emb,
+        index=index,
+        docstore=InMemoryDocstore({str(i): chunk for i, chunk in enumerate(chunks)}),
+        index_to_docstore_id={i: str(i) for i in range(len(chunks))},
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+    )
 
 
 def build_vectorstore(
     docs: List[Document],
-    chunk_size: int = 750,
-    chunk_overlap: int = 150,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
     model_name: str = DEFAULT_EMBED_MODEL,
+    index_type: str = DEFAULT_INDEX_TYPE,
+    cache_dir: Optional[str] = None,
 ) -> Optional[FAISS]:
     if not docs:
         return None
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
+    tokenizer = _get_tokenizer(model_name)
+    splitter = _get_splitter(model_name, chunk_size, chunk_overlap)
+    chunks = _coalesce_chunks(
+        _split_docs(docs, model_name, chunk_size, chunk_overlap),
+        splitter,
+        lambda text: len(tokenizer.encode(text, add_special_tokens=False)),
+        chunk_size,
+    )
+    if not chunks:
+        return None
+    emb = _make_embeddings(model_name)
+    vectors = _embed_chunks(
+        emb,
+        [chunk.page_content for chunk in chunks],
+        _embedding_id(model_name),
+        cache_dir,
     )
-    chunks = splitter.split_documents(docs)
-    emb = HuggingFaceEmbeddings(model_name=model_name)
-    return FAISS.from_documents(chunks, emb)
+    return _make_faiss_store(emb, _build_faiss_index(vectors, index_type), chunks)
 
 
-def make_retriever(vs: Optional[FAISS], k: int = 8):
+def make_retriever(vs: Optional[FAISS], k: int = 8, search_type: str = DEFAULT_SEARCH_TYPE):
     if vs is None:
         return None
-    return vs.as_retriever(search_kwargs={"k": k})
+    search_kwargs = {"k": k}
+    if search_type == "mmr":
+        # Over-fetch, then drop near-duplicate chunks so fewer redundant tokens reach the LLM.
+        search_kwargs.update(fetch_k=4 * k, lambda_mult=0.5)
+    return vs.as_retriever(search_type=search_type, search_kwargs=search_kwargs)
 
 
-def format_docs(docs: List[Document]):
+def format_docs(docs: List[Document], max_chars: Optional[int] = None):
     if not docs:
         return "[KB:empty]\n(No relevant knowledge found.)"
 
@@ -48,14 +373,17 @@ def format_docs(docs: List[Document]):
             tag = f"[KB:{src}]"
         else:
             tag = f"[KB:{src}:p{page}]"
-        formatted.append(f"{tag}\n{doc.page_content}")
+        body = doc.page_content
+        if max_chars and len(body) > max_chars:
+            body = body[:max_chars].rstrip() + " ..."
+        formatted.append(f"{tag}\n{body}")
 
     return "\n\n---\n\n".join(formatted)
 
 
 def _fingerprint_files(glob_pattern: str) -> str:
     # Stable fingerprint based on path/size/mtime to know when KB changed.
-    hasher = hashlib.sha256()
+    hasher = hash128()
     for path in sorted(glob.glob(glob_pattern)):
         try:
             stat = os.stat(path)
@@ -67,24 +395,73 @@ def _fingerprint_files(glob_pattern: str) -> str:
 
 
 def _persist_vectorstore(vs: FAISS, index_dir: str, meta: dict):
+    # Raw FAISS index plus a JSON docstore instead of save_local's pickle, so loading
+    # never needs allow_dangerous_deserialization.
     os.makedirs(index_dir, exist_ok=True)
-    vs.save_local(index_dir)
+    faiss.write_index(vs.index, os.path.join(index_dir, INDEX_FILE))
+    docs = [vs.docstore.search(vs.index_to_docstore_id[i]) for i in range(vs.index.ntotal)]
+    with open(os.path.join(index_dir, DOCS_FILE), "w", encoding="utf-8") as handle:
+        json.dump(
+            [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs],
+            handle,
+            default=str,
+        )
     with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as handle:
         json.dump(meta, handle, indent=2)
 
 
-def _load_if_fresh(index_dir: str, expected_fp: str, model_name: str) -> Optional[FAISS]:
+def _chunking_meta(chunk_size: int, chunk_overlap: int) -> dict:
+    return {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "chunk_unit": "tokens"}
+
+
+def _read_index(path: str, index_type: str):
+    # IO_FLAG_MMAP only defers IVF inverted lists; flat, sq8 and HNSW storage codes need
+    # IO_FLAG_MMAP_IFC (newer FAISS). The two cannot be combined on IVF files. An ivf or
+    # ivfpq KB small enough to fall back to HNSW gets no mapping, which is fine at that
+    # size. The HNSW graph itself is always read into memory.
+    if index_type in ("ivf", "ivfpq"):
+        flag = faiss.IO_FLAG_MMAP
+    else:
+        flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    if flag is not None:
+        try:
+            return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            pass
+    return faiss.read_index(path)
+
+
+def _load_if_fresh(
+    index_dir: str,
+    expected_fp: str,
+    model_name: str,
+    index_type: str = DEFAULT_INDEX_TYPE,
+    chunking: Optional[dict] = None,
+) -> Optional[FAISS]:
     meta_path = os.path.join(index_dir, "meta.json")
     try:
-        with open(meta_path, encoding="utf-8") as handle:
-            meta = json.load(handle)
+        meta = _read_json(meta_path)
         if meta.get("kb_fingerprint") != expected_fp:
             return None
-        if meta.get("embedding_model") != model_name:
+        if meta.get("embedding_model") != _embedding_id(model_name):
+            return None
+        if meta.get("index_type", "flat") != index_type:
+            return None
+        if meta.get("metric", "l2") != INDEX_METRIC:
+            return None
+        if meta.get("kb_loader") != LOADER_ID:
+            return None
+        if chunking and any(meta.get(key) != value for key, value in chunking.items()):
+            return None
+
+        index = _read_index(os.path.join(index_dir, INDEX_FILE), index_type)
+        records = _read_json(os.path.join(index_dir, DOCS_FILE))
+        if len(records) != index.ntotal:
             return None
+        _tune_loaded_index(index)
 
-        emb = HuggingFaceEmbeddings(model_name=model_name)
-        return FAISS.load_local(index_dir, emb, allow_dangerous_deserialization=True)
+        chunks = [Document(page_content=r["page_content"], metadata=r["metadata"]) for r in records]
+        return _make_faiss_store(_make_embeddings(model_name), index, chunks)
     except Exception:
         return None
 
@@ -93,23 +470,27 @@ def build_or_load_index(
     docs: List[Document],
     kb_glob: str,
     index_dir: str = "faiss_index",
-    chunk_size: int = 750,
-    chunk_overlap: int = 150,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
     model_name: str = DEFAULT_EMBED_MODEL,
     k: int = 8,
+    index_type: str = DEFAULT_INDEX_TYPE,
+    search_type: str = DEFAULT_SEARCH_TYPE,
 ):
     kb_fp = _fingerprint_files(kb_glob)
+    chunking = _chunking_meta(chunk_size, chunk_overlap)
 
-    vs = _load_if_fresh(index_dir, kb_fp, model_name)
+    vs = _load_if_fresh(index_dir, kb_fp, model_name, index_type=index_type, chunking=chunking)
     if vs:
         return (
             vs,
-            make_retriever(vs, k=k),
+            make_retriever(vs, k=k, search_type=search_type),
             {
                 "status": "loaded",
                 "source": "disk",
                 "kb_fingerprint": kb_fp,
-                "embedding_model": model_name,
+                "embedding_model": _embedding_id(model_name),
+                "index_type": index_type,
             },
         )
 
@@ -118,21 +499,25 @@ def build_or_load_index(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
         model_name=model_name,
+        index_type=index_type,
+        cache_dir=index_dir,
     )
     if not vs:
         return None, None, {"status": "empty", "kb_fingerprint": kb_fp}
 
     meta = {
         "kb_fingerprint": kb_fp,
-        "embedding_model": model_name,
+        "embedding_model": _embedding_id(model_name),
         "built_at": int(time.time()),
-        "chunk_size": chunk_size,
-        "chunk_overlap": chunk_overlap,
+        **chunking,
+        "index_type": index_type,
+        "metric": INDEX_METRIC,
+        "kb_loader": LOADER_ID,
     }
     _persist_vectorstore(vs, index_dir, meta)
 
     return (
         vs,
-        make_retriever(vs, k=k),
+        make_retriever(vs, k=k, search_type=search_type),
         {**meta, "status": "built", "source": "rebuild"},
     )
@@ -1,29 +1,40 @@
 import asyncio
 import os
 import re
+from functools import partial
 from typing import List, Optional
 
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from chat_chain import make_chat_chain
-from kb_loader import load_kb_docs
-from retriever import build_or_load_index, format_docs
-from summarizer_chain import make_summarizer_chain
-from translation import translate_texts
-
+# Load .env before local modules read their module-level settings.
 load_dotenv()
 
+from chat_chain import make_chat_chain  # noqa: E402
+from kb_loader import load_kb_docs  # noqa: E402
+from llm import get_llm  # noqa: E402
+from retriever import build_or_load_index, format_docs  # noqa: E402
+from summarizer_chain import make_summarizer_chain  # noqa: E402
+from translation import translate_texts, warmup as warmup_translation  # noqa: E402
+
 INDEX_DIR = os.getenv("FAISS_INDEX_DIR", "faiss_index")
 KB_GLOB = os.getenv("KB_GLOB", "sample_kb/*")
 EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
-CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "800"))
-CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "120"))
+# Measured in embedding-model tokens.
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "200"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "20"))
 TOP_K = int(os.getenv("TOP_K", "8"))
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "hnsw")
+RETRIEVER_SEARCH_TYPE = os.getenv("RETRIEVER_SEARCH_TYPE", "mmr")
+# Safety cap only: a 200-token chunk is roughly 800-1000 characters and should fit whole.
+KB_DOC_MAX_CHARS = int(os.getenv("KB_DOC_MAX_CHARS", "1200"))
 ENABLE_RAG_INDEX = os.getenv("ENABLE_RAG_INDEX", "1") == "1"
 ALLOW_MOCK_FALLBACK = os.getenv("ALLOW_MOCK_FALLBACK", "1") == "1"
+PRELOAD_LLM = os.getenv("PRELOAD_LLM", "1") == "1"
+PRELOAD_TRANSLATION = os.getenv("PRELOAD_TRANSLATION", "0") == "1"
 
 app = FastAPI(title="Medical Summarizer API", version="2.0.0")
 app.add_middleware(
@@ -41,6 +52,46 @@ READY_EVENT = asyncio.Event()
 READY_META = {"status": "initializing"}
 LAST_REPORT_TEXT: Optional[str] = None
 
+# Report-only chains are usable immediately; KB-backed variants are built once the
+# index is ready.
+SUMMARIZER_CHAIN = make_summarizer_chain()
+CHAT_CHAIN = make_chat_chain()
+KB_SUMMARIZER_CHAIN = None
+KB_CHAT_CHAIN = None
+
+# PDF-extracted text often carries non-breaking, thin and zero-width spaces; map
+# them in one pass before the regex normalization.
+_WS_TABLE = str.maketrans(
+    {
+        **{chr(code): " " for code in range(0x2002, 0x200B)},
+        "\u00A0": " ",
+        "\u202F": " ",
+        "\u205F": " ",
+        "\u3000": " ",
+        "\u200B": "",
+        "\u200C": "",
+        "\u200D": "",
+        "\u2060": "",
+        "\uFEFF": "",
+    }
+)
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+_FINDING_TOKENS = ("pain", "blood", "pressure", "heart", "chest", "lab", "imaging", "follow-up")
+_FINDING_RE = re.compile(
+    r"\b(" + "|".join(re.escape(token) for token in _FINDING_TOKENS) + r")\b",
+    re.IGNORECASE,
+)
+
+# One scan for the whole normalization: a run of comparators swallows the whitespace
+# around it, horizontal whitespace collapses, and letter/digit/unit boundaries get a
+# space. Order matters so a comparator claims its leading whitespace first.
+_P_NORMALIZE = re.compile(
+    r"\s*(?P<cmp>[<>≤≥](?:\s*[<>≤≥])*)\s*"
+    r"|[ \t\f\v]+"
+    r"|(?<=[A-Za-z])(?=\d)"
+    r"|(?<=\d)(?=[A-Za-zµ%/])"
+)
+
 
 class SummarizeReq(BaseModel):
     report: str
@@ -64,16 +115,17 @@ class TranslateReq(BaseModel):
     source_lang: str = "en"
 
 
+def _normalize_match(match: re.Match) -> str:
+    comparators = match.group("cmp")
+    if comparators is None:
+        return " "
+    return " " + " ".join(ch for ch in comparators if not ch.isspace()) + " "
+
+
 def normalize_report_text(text: str) -> str:
     if not text:
         return text
-    normalized = text.replace("\u00A0", " ").replace("\u2009", " ")
-    normalized = re.sub(r"(?<=[A-Za-z])(?=\d)", " ", normalized)
-    normalized = re.sub(r"(?<=\d)(?=[A-Za-zµ%/])", " ", normalized)
-    normalized = re.sub(r"(?<=[A-Za-z0-9%/µ])(?=[<>≤≥])", " ", normalized)
-    normalized = re.sub(r"([<>≤≥])(?=[0-9])", r"\1 ", normalized)
-    normalized = re.sub(r"\s*([<>≤≥])\s*", r" \1 ", normalized)
-    normalized = re.sub(r"[ \t\f\v]+", " ", normalized)
+    normalized = _P_NORMALIZE.sub(_normalize_match, text.translate(_WS_TABLE))
     return normalized.strip()
 
 
@@ -82,14 +134,12 @@ def _mock_summary(report: str) -> str:
     if not text:
         return "### SUMMARY\nNo report content provided."
 
-    sentences = re.split(r"(?<=[.!?])\s+", text)
+    sentences = _SENTENCE_SPLIT.split(text)
     sentences = [entry.strip() for entry in sentences if entry.strip()]
     overview = " ".join(sentences[:4]) if sentences else text[:400]
 
-    finding_lines = []
-    for token in ["pain", "blood", "pressure", "heart", "chest", "lab", "imaging", "follow-up"]:
-        if re.search(rf"\b{re.escape(token)}\b", text, re.IGNORECASE):
-            finding_lines.append(f"- Mentions {token} [REPORT]")
+    found = {match.group(1).lower() for match in _FINDING_RE.finditer(text)}
+    finding_lines = [f"- Mentions {token} [REPORT]" for token in _FINDING_TOKENS if token in found]
     if not finding_lines:
         finding_lines = [
             "- The report text was captured and can be reviewed in chat [REPORT]",
@@ -133,14 +183,19 @@ def _mock_chat_answer(question: str, report: str) -> str:
 
 
 async def _async_build_index():
-    global KB_DOCS, VS, RETRIEVER, READY_META
+    global KB_DOCS, VS, RETRIEVER, READY_META, KB_SUMMARIZER_CHAIN, KB_CHAT_CHAIN
     try:
         if not ENABLE_RAG_INDEX:
             READY_META = {"ok": True, "status": "disabled", "reason": "ENABLE_RAG_INDEX=0"}
             return
 
-        KB_DOCS = load_kb_docs(KB_GLOB)
-        VS, RETRIEVER, meta = build_or_load_index(
+        # Parsing, embedding and FAISS work are blocking; run them off the event loop so
+        # /health and non-KB requests are served while the index builds.
+        KB_DOCS = await asyncio.to_thread(
+            load_kb_docs, KB_GLOB, cache_dir=os.path.join(INDEX_DIR, "kb_cache")
+        )
+        VS, RETRIEVER, meta = await asyncio.to_thread(
+            build_or_load_index,
             KB_DOCS,
             kb_glob=KB_GLOB,
             index_dir=INDEX_DIR,
@@ -148,7 +203,13 @@ async def _async_build_index():
             chunk_overlap=CHUNK_OVERLAP,
             model_name=EMBED_MODEL,
             k=TOP_K,
+            index_type=FAISS_INDEX_TYPE,
+            search_type=RETRIEVER_SEARCH_TYPE,
         )
+        if RETRIEVER is not None:
+            format_kb = partial(format_docs, max_chars=KB_DOC_MAX_CHARS)
+            KB_SUMMARIZER_CHAIN = make_summarizer_chain(RETRIEVER, format_kb)
+            KB_CHAT_CHAIN = make_chat_chain(RETRIEVER, format_kb)
         READY_META = {"ok": True, "kb_docs": len(KB_DOCS), **meta}
     except Exception as exc:
         # Keep app available even if indexing fails.
@@ -157,9 +218,28 @@ async def _async_build_index():
         READY_EVENT.set()
 
 
+async def _async_warm_llm():
+    # Have Ollama load weights and allocate its KV cache before the first real request.
+    try:
+        await get_llm().ainvoke("Reply with OK.")
+    except Exception as exc:
+        print(f"[startup] LLM warmup skipped: {exc}")
+
+
+async def _async_warm_translation():
+    try:
+        await asyncio.to_thread(warmup_translation)
+    except Exception as exc:
+        print(f"[startup] Translation warmup skipped: {exc}")
+
+
 @app.on_event("startup")
 async def on_startup():
     asyncio.create_task(_async_build_index())
+    if PRELOAD_LLM:
+        asyncio.create_task(_async_warm_llm())
+    if PRELOAD_TRANSLATION:
+        asyncio.create_task(_async_warm_translation())
 
 
 @app.get("/health")
@@ -167,14 +247,30 @@ async def health():
     return {"ready": READY_EVENT.is_set(), "meta": READY_META}
 
 
-@app.post("/summarize")
-async def summarize(req: SummarizeReq):
+def _prepare_summary(req: SummarizeReq) -> str:
+    # Shared by /summarize and /summarize/stream.
     global LAST_REPORT_TEXT
     report = normalize_report_text(req.report)
     if not report:
         raise HTTPException(status_code=400, detail="report cannot be empty")
 
     LAST_REPORT_TEXT = report
+    return report
+
+
+def _prepare_chat(req: ChatReq):
+    # Shared by /chat and /chat/stream; the caller decides how to answer without a report.
+    report = normalize_report_text(req.report or LAST_REPORT_TEXT or "")
+    question = (req.question or "").strip()
+
+    if not question:
+        raise HTTPException(status_code=400, detail="question cannot be empty")
+    return question, report
+
+
+@app.post("/summarize")
+async def summarize(req: SummarizeReq):
+    report = _prepare_summary(req)
 
     if not READY_EVENT.is_set() and req.use_kb:
         return {
@@ -185,13 +281,10 @@ async def summarize(req: SummarizeReq):
             "meta": READY_META,
         }
 
-    chain = make_summarizer_chain(
-        retriever=RETRIEVER if (req.use_kb and RETRIEVER) else None,
-        format_docs_fn=format_docs,
-    )
+    chain = KB_SUMMARIZER_CHAIN if (req.use_kb and KB_SUMMARIZER_CHAIN is not None) else SUMMARIZER_CHAIN
 
     try:
-        output = chain.invoke({"report": report})
+        output = await chain.ainvoke({"report": report})
     except Exception as exc:
         if not ALLOW_MOCK_FALLBACK:
             raise HTTPException(status_code=503, detail=str(exc)) from exc
@@ -206,13 +299,50 @@ async def summarize(req: SummarizeReq):
     }
 
 
+async def _relay_stream(first: str, rest):
+    yield first
+    if rest is None:
+        return
+    try:
+        async for chunk in rest:
+            yield chunk
+    except Exception as exc:
+        # Headers are already sent, so a mid-stream failure can only end the body.
+        print(f"[stream] Generation failed: {exc}")
+
+
+async def _stream_chain(chain, inputs: dict, fallback) -> StreamingResponse:
+    # Pull the first chunk before committing to a 200 so a failure to reach Ollama
+    # surfaces like it does on the JSON endpoints: mock text or a 503.
+    stream = chain.astream(inputs)
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        first, stream = "", None
+    except Exception as exc:
+        if not ALLOW_MOCK_FALLBACK:
+            raise HTTPException(status_code=503, detail=str(exc)) from exc
+        first, stream = fallback(), None
+    return StreamingResponse(_relay_stream(first, stream), media_type="text/plain; charset=utf-8")
+
+
+@app.post("/summarize/stream")
+async def summarize_stream(req: SummarizeReq):
+    report = _prepare_summary(req)
+
+    if not READY_EVENT.is_set() and req.use_kb:
+        raise HTTPException(
+            status_code=503,
+            detail="KB index is still building. Retry shortly or disable KB for now.",
+        )
+
+    chain = KB_SUMMARIZER_CHAIN if (req.use_kb and KB_SUMMARIZER_CHAIN is not None) else SUMMARIZER_CHAIN
+    return await _stream_chain(chain, {"report": report}, partial(_mock_summary, report))
+
+
 @app.post("/chat")
 async def chat(req: ChatReq):
-    report = normalize_report_text(req.report or LAST_REPORT_TEXT or "")
-    question = (req.question or "").strip()
-
-    if not question:
-        raise HTTPException(status_code=400, detail="question cannot be empty")
+    question, report = _prepare_chat(req)
     if not report:
         return {
             "text": (
@@ -222,12 +352,9 @@ async def chat(req: ChatReq):
             "ready": False,
         }
 
-    chain = make_chat_chain(
-        retriever=RETRIEVER if (req.use_kb and RETRIEVER) else None,
-        format_docs_fn=format_docs,
-    )
+    chain = KB_CHAT_CHAIN if (req.use_kb and KB_CHAT_CHAIN is not None) else CHAT_CHAIN
     try:
-        answer = chain.invoke({"question": question, "report": report})
+        answer = await chain.ainvoke({"question": question, "report": report})
     except Exception as exc:
         if not ALLOW_MOCK_FALLBACK:
             raise HTTPException(status_code=503, detail=str(exc)) from exc
@@ -236,6 +363,23 @@ async def chat(req: ChatReq):
     return {"text": answer, "ready": True, "meta": READY_META}
 
 
+@app.post("/chat/stream")
+async def chat_stream(req: ChatReq):
+    question, report = _prepare_chat(req)
+    if not report:
+        raise HTTPException(
+            status_code=400,
+            detail="No patient report is available. Summarize a report first or include it in this request.",
+        )
+
+    chain = KB_CHAT_CHAIN if (req.use_kb and KB_CHAT_CHAIN is not None) else CHAT_CHAIN
+    return await _stream_chain(
+        chain,
+        {"question": question, "report": report},
+        partial(_mock_chat_answer, question, report),
+    )
+
+
 @app.post("/translate")
 async def translate(req: TranslateReq):
     if not req.items:
@@ -243,7 +387,10 @@ async def translate(req: TranslateReq):
 
     texts = [item.text for item in req.items]
     try:
-        translated = translate_texts(
+        # Generation is blocking and may wait on a warmup holding the model lock; keep
+        # it off the event loop so streaming and summarize requests are not stalled.
+        translated = await asyncio.to_thread(
+            translate_texts,
             texts,
             source_lang=req.source_lang,
             target_lang=req.target_lang,
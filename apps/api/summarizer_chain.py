@@ -1,10 +1,9 @@
-import os
-
-from langchain_community.chat_models import ChatOllama
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableLambda
 
+from llm import get_llm
+
 SYSTEM_PROMPT = """
 You are a careful clinical summarization assistant.
 
@@ -36,19 +35,15 @@ Create a concise response with these sections:
 """
 
 
-def make_summarizer_chain(retriever=None, format_docs_fn=None):
-    llm = ChatOllama(
-        model=os.getenv("OLLAMA_MODEL", "llama3.2"),
-        temperature=0.0,
-    )
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", SYSTEM_PROMPT),
+        ("human", HUMAN_PROMPT),
+    ]
+)
 
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", SYSTEM_PROMPT),
-            ("human", HUMAN_PROMPT),
-        ]
-    )
 
+def make_summarizer_chain(retriever=None, format_docs_fn=None):
     def retrieve_kb(inputs: dict) -> str:
         if retriever is None or format_docs_fn is None:
             return "[KB:empty]\n(No KB used.)"
@@ -65,8 +60,8 @@ def make_summarizer_chain(retriever=None, format_docs_fn=None):
             "report": lambda x: x.get("report", ""),
             "kb": kb_runnable,
         }
-        | prompt
-        | llm
+        | SUMMARY_PROMPT
+        | get_llm()
         | StrOutputParser()
     )
 
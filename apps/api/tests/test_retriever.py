@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+import faiss
+import numpy as np
+
+from retriever import (
+    IVF_MIN_POINTS_PER_LIST,
+    IVF_MIN_VECTORS,
+    IVFPQ_MIN_VECTORS,
+    _build_faiss_index,
+)
+
+
+def _unit_vectors(n: int, dim: int = 64) -> np.ndarray:
+    vectors = np.random.default_rng(0).standard_normal((n, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _build_capturing_stderr(vectors: np.ndarray, index_type: str):
+    # FAISS logs clustering warnings from C++ straight to fd 2, not through Python.
+    with tempfile.TemporaryFile(mode="w+") as captured:
+        saved = os.dup(2)
+        os.dup2(captured.fileno(), 2)
+        try:
+            index = _build_faiss_index(vectors, index_type)
+        finally:
+            os.dup2(saved, 2)
+            os.close(saved)
+        captured.seek(0)
+        return index, captured.read()
+
+
+class IvfTrainingTest(unittest.TestCase):
+    def test_ivf_at_threshold_trains_without_warnings(self):
+        index, stderr = _build_capturing_stderr(_unit_vectors(IVF_MIN_VECTORS), "ivf")
+        self.assertIsInstance(index, faiss.IndexIVF)
+        self.assertLessEqual(index.nlist * IVF_MIN_POINTS_PER_LIST, IVF_MIN_VECTORS)
+        self.assertNotIn("WARNING clustering", stderr)
+
+    def test_ivfpq_at_threshold_trains_without_warnings(self):
+        index, stderr = _build_capturing_stderr(_unit_vectors(IVFPQ_MIN_VECTORS), "ivfpq")
+        self.assertIsInstance(index, faiss.IndexIVFPQ)
+        self.assertLessEqual(index.nlist * IVF_MIN_POINTS_PER_LIST, IVFPQ_MIN_VECTORS)
+        self.assertNotIn("WARNING clustering", stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,22 @@
 import os
+import threading
+from collections import OrderedDict
 from functools import lru_cache
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 TRANSLATION_MODEL = os.getenv("TRANSLATION_MODEL", "facebook/nllb-200-distilled-600M")
+# Optional CTranslate2 conversion of TRANSLATION_MODEL (see README). When set, decoding
+# runs on the INT8 CTranslate2 runtime instead of the FP32 transformers model.
+TRANSLATION_CT2_DIR = os.getenv("TRANSLATION_CT2_DIR", "")
+# Upper bound on padded tokens per generate call; inputs are length-sorted and packed.
+TRANSLATION_MAX_BATCH_TOKENS = int(os.getenv("TRANSLATION_MAX_BATCH_TOKENS", "4096"))
+# "auto" picks cuda when available; on GPU the transformers model runs fp16 and the
+# CTranslate2 model int8_float16.
+TRANSLATION_DEVICE = os.getenv("TRANSLATION_DEVICE", "auto")
+# Opt-in torch.compile of the decoder forward; pays a compile on first use.
+TRANSLATION_COMPILE = os.getenv("TRANSLATION_COMPILE", "0") == "1"
+# Recent (source, target, max_new_tokens, text) translations kept in memory; 0 disables the cache.
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "4096"))
 
 NLLB_LANG_CODES: Dict[str, str] = {
     "en": "eng_Latn",
@@ -16,13 +30,51 @@ NLLB_LANG_CODES: Dict[str, str] = {
 }
 
 
+_CACHE: "OrderedDict[Tuple[str, str, int, str], str]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+# warmup() runs in a worker thread alongside /translate. Serialize the model load
+# (lru_cache does not stop two threads loading it at once) and the shared
+# tokenizer.src_lang setting together with the encode/generate that depends on it.
+_MODEL_LOCK = threading.Lock()
+
+
 @lru_cache(maxsize=1)
 def _load_model_and_tokenizer():
     # Lazy import so backend can start even when translation stack is not installed.
-    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+    from transformers import AutoTokenizer
 
     tokenizer = AutoTokenizer.from_pretrained(TRANSLATION_MODEL)
-    model = AutoModelForSeq2SeqLM.from_pretrained(TRANSLATION_MODEL)
+    if TRANSLATION_CT2_DIR:
+        import ctranslate2
+
+        device = TRANSLATION_DEVICE
+        if device == "auto":
+            device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+        device, _, index = device.partition(":")
+        translator = ctranslate2.Translator(
+            TRANSLATION_CT2_DIR,
+            device=device,
+            device_index=int(index or 0),
+            # INT8 weights either way; activations run in fp16 on GPU.
+            compute_type="int8_float16" if device == "cuda" else "int8",
+            inter_threads=1,
+            intra_threads=os.cpu_count() or 0,
+        )
+        return tokenizer, translator
+
+    import torch
+    from transformers import AutoModelForSeq2SeqLM
+
+    device = TRANSLATION_DEVICE
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtype = torch.float16 if device.startswith("cuda") else torch.float32
+    model = AutoModelForSeq2SeqLM.from_pretrained(TRANSLATION_MODEL, dtype=dtype)
+    model = model.to(device).eval()
+    model.generation_config.use_cache = True
+    if TRANSLATION_COMPILE:
+        # Batch and decode lengths vary per call, so compile with dynamic shapes.
+        model.forward = torch.compile(model.forward, dynamic=True)
     return tokenizer, model
 
 
@@ -37,6 +89,78 @@ def _resolve_lang_code(code: str) -> str:
     raise ValueError(f"Unsupported language code: {code}")
 
 
+@lru_cache(maxsize=None)
+def _lang_token_id(tokenizer, code: str) -> int:
+    return tokenizer.convert_tokens_to_ids(code)
+
+
+def _generate_hf(tokenizer, model, texts: List[str], tgt_code: str, max_new_tokens: int) -> List[str]:
+    import torch
+
+    encoded = tokenizer(
+        texts,
+        return_tensors="pt",
+        padding=True,
+        truncation=True,
+    ).to(model.device)
+    forced_bos_token_id = _lang_token_id(tokenizer, tgt_code)
+
+    with torch.inference_mode():
+        generated = model.generate(
+            **encoded,
+            forced_bos_token_id=forced_bos_token_id,
+            max_new_tokens=max_new_tokens,
+        )
+    return tokenizer.batch_decode(generated, skip_special_tokens=True)
+
+
+def _generate_ct2(tokenizer, translator, texts: List[str], tgt_code: str, max_new_tokens: int) -> List[str]:
+    source = [
+        tokenizer.convert_ids_to_tokens(tokenizer(text, truncation=True).input_ids)
+        for text in texts
+    ]
+    results = translator.translate_batch(
+        source,
+        target_prefix=[[tgt_code]] * len(source),
+        beam_size=1,
+        max_decoding_length=max_new_tokens,
+    )
+    decoded = []
+    for result in results:
+        # First hypothesis token is the forced target language code.
+        tokens = result.hypotheses[0][1:]
+        decoded.append(
+            tokenizer.decode(tokenizer.convert_tokens_to_ids(tokens), skip_special_tokens=True)
+        )
+    return decoded
+
+
+def _pack_batches(lengths: List[int], max_tokens: int) -> List[List[int]]:
+    # Sort by length so each batch pads to a similar size, then greedily fill
+    # batches while the padded size (count * longest) stays within budget.
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    batches: List[List[int]] = []
+    current: List[int] = []
+    for idx in order:
+        longest = lengths[idx]  # ascending order, so the newest item is the longest
+        if current and (len(current) + 1) * longest > max_tokens:
+            batches.append(current)
+            current = []
+        current.append(idx)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def warmup():
+    # Load weights and run one tiny batch so the first /translate skips the cold start.
+    generate = _generate_ct2 if TRANSLATION_CT2_DIR else _generate_hf
+    with _MODEL_LOCK:
+        tokenizer, model = _load_model_and_tokenizer()
+        tokenizer.src_lang = NLLB_LANG_CODES["en"]
+        generate(tokenizer, model, ["Hello."], NLLB_LANG_CODES["es"], 8)
+
+
 def translate_texts(
     texts: List[str],
     source_lang: str = "en",
@@ -46,24 +170,38 @@ def translate_texts(
     if not texts:
         return []
 
-    tokenizer, model = _load_model_and_tokenizer()
-
     src_code = _resolve_lang_code(source_lang)
     tgt_code = _resolve_lang_code(target_lang)
-    tokenizer.src_lang = src_code
 
-    encoded = tokenizer(
-        texts,
-        return_tensors="pt",
-        padding=True,
-        truncation=True,
-    )
-    forced_bos_token_id = tokenizer.convert_tokens_to_ids(tgt_code)
+    # Reports repeat headers and boilerplate lines; translate each distinct text once
+    # and serve repeats across requests from the LRU cache.
+    unique = list(dict.fromkeys(texts))
+    done: Dict[str, str] = {}
+    with _CACHE_LOCK:
+        for text in unique:
+            key = (src_code, tgt_code, max_new_tokens, text)
+            if key in _CACHE:
+                _CACHE.move_to_end(key)
+                done[text] = _CACHE[key]
+    pending = [text for text in unique if text not in done]
 
-    generated = model.generate(
-        **encoded,
-        forced_bos_token_id=forced_bos_token_id,
-        max_new_tokens=max_new_tokens,
-    )
-    translated = tokenizer.batch_decode(generated, skip_special_tokens=True)
-    return [entry.strip() for entry in translated]
+    if pending:
+        generate = _generate_ct2 if TRANSLATION_CT2_DIR else _generate_hf
+        with _MODEL_LOCK:
+            tokenizer, model = _load_model_and_tokenizer()
+            tokenizer.src_lang = src_code
+
+            lengths = [len(ids) for ids in tokenizer(pending, truncation=True).input_ids]
+            for batch in _pack_batches(lengths, TRANSLATION_MAX_BATCH_TOKENS):
+                outputs = generate(tokenizer, model, [pending[i] for i in batch], tgt_code, max_new_tokens)
+                for idx, out_text in zip(batch, outputs):
+                    done[pending[idx]] = out_text.strip()
+
+        if TRANSLATION_CACHE_SIZE > 0:
+            with _CACHE_LOCK:
+                for text in pending:
+                    _CACHE[(src_code, tgt_code, max_new_tokens, text)] = done[text]
+                while len(_CACHE) > TRANSLATION_CACHE_SIZE:
+                    _CACHE.popitem(last=False)
+
+    return [done[text] for text in texts]